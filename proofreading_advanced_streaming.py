@@ -4,25 +4,34 @@
 高度なストリーミング処理版 - プログレス表示・エラーハンドリング・再試行機能付き
 """
 
+import argparse
+import importlib
 import subprocess
 import sys
 import os
 import time
 import json
+import glob
+import math
+import queue
+import threading
 from datetime import datetime
 
-def install_package(package):
-    """パッケージがインストールされていない場合に自動インストール"""
+def install_package(package, module_name):
+    """パッケージがインストールされていない場合に自動インストール
+
+    module_name はインポート時の名前（pip のパッケージ名とは異なることがある）
+    """
     try:
-        __import__(package)
+        importlib.import_module(module_name)
     except ImportError:
         print(f"{package}パッケージをインストールしています...")
         subprocess.check_call([sys.executable, "-m", "pip", "install", package])
         print(f"{package}のインストールが完了しました。")
 
 # 必要なパッケージを自動インストール
-install_package("python-dotenv")
-install_package("google-genai")
+install_package("python-dotenv", "dotenv")
+install_package("google-genai", "google.genai")
 
 import os
 from dotenv import load_dotenv
@@ -35,30 +44,120 @@ load_dotenv()
 # APIキーを環境変数から取得
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 
-if not GEMINI_API_KEY:
-    raise ValueError("GEMINI_API_KEYが設定されていません。"
-                    ".envファイルに以下を追加してください：\n"
-                    "GEMINI_API_KEY=your-api-key-here")
+# APIクライアント（見積もりだけならキーは不要なので、最初に使うときに作成）
+client = None
+
+def get_client():
+    """APIキーを確認してクライアントを返す"""
+    global client
+    if client is None:
+        if not GEMINI_API_KEY:
+            raise ValueError("GEMINI_API_KEYが設定されていません。"
+                            ".envファイルに以下を追加してください：\n"
+                            "GEMINI_API_KEY=your-api-key-here")
+        # APIキーのモデルへの設定
+        client = genai.Client(api_key=GEMINI_API_KEY)
+    return client
+
+MAX_OUTPUT_TOKENS = 8192
+
+# gemini-2.0-flash の料金（USD / 100万トークン）
+INPUT_PRICE_PER_MILLION_TOKENS = 0.10
+OUTPUT_PRICE_PER_MILLION_TOKENS = 0.40
+
+# 過去のログがない場合の見積もり係数
+DEFAULT_INPUT_TOKENS_PER_CHAR = 1.0  # 日本語は1文字あたり約1トークン（プロンプト込み）
+DEFAULT_OUTPUT_TOKENS_PER_INPUT_TOKEN = 1.0  # 校正なので入力とほぼ同じ長さ
+DEFAULT_SECONDS_PER_OUTPUT_TOKEN = 0.01
+DEFAULT_REQUESTS_PER_CHUNK = 1.0
 
-# APIキーのモデルへの設定
-client = genai.Client(api_key=GEMINI_API_KEY)
+def response_text(response):
+    """ストリーミングレスポンス1件からテキストを取り出す"""
+    text = ""
+    if response.candidates and response.candidates[0].content:
+        for part in response.candidates[0].content.parts:
+            if part.text:
+                text += part.text
+    return text
+
+def response_usage(response):
+    """レスポンスのトークン使用量 (入力, 出力) を返す。含まれていなければ None"""
+    usage = getattr(response, 'usage_metadata', None)
+    if usage is None or usage.prompt_token_count is None:
+        return None
+    return usage.prompt_token_count, usage.candidates_token_count or 0
+
+def chunk_label(chunk_num, total_chunks):
+    """チャンク番号の表示用文字列（総数が未確定なら番号のみ）"""
+    if total_chunks is None:
+        return f"{chunk_num}"
+    return f"{chunk_num}/{total_chunks}"
+
+class StreamStallError(Exception):
+    """ストリームの最初のトークン、または次のトークンが時間内に届かなかった"""
+
+class RateLimiter:
+    """リクエスト開始の間隔を一定以上に保つレートリミッター（スレッドセーフ）"""
+    
+    def __init__(self, requests_per_minute=20):
+        self.interval = 60.0 / requests_per_minute
+        self.next_slot = 0.0
+        self.lock = threading.Lock()
+    
+    def wait_time(self):
+        """次のリクエストを送れるまでの秒数"""
+        with self.lock:
+            return max(0.0, self.next_slot - time.monotonic())
+    
+    def try_acquire(self):
+        """すぐに送れるなら枠を確保して True、そうでなければ False"""
+        with self.lock:
+            now = time.monotonic()
+            if now < self.next_slot:
+                return False
+            self.next_slot = now + self.interval
+            return True
+    
+    def acquire(self):
+        """枠が空くまで待ってから確保"""
+        while not self.try_acquire():
+            time.sleep(self.wait_time())
 
 class StreamingProcessor:
     """ストリーミング処理を管理するクラス"""
     
-    def __init__(self, output_file_path):
+    def __init__(self, output_file_path, rate_limiter=None,
+                 first_token_timeout=60, stall_timeout=30,
+                 hedge=False, hedge_percentile=95, hedge_min_samples=3):
+        """
+        first_token_timeout: 最初のトークンが届くまでの上限（秒、None で無制限）
+        stall_timeout: トークン間の無応答の上限（秒、None で無制限）
+        hedge: 有効にすると、これまでのチャンク処理時間の hedge_percentile
+            パーセンタイルを超えたチャンクに重複リクエストを送り、先に
+            完了した方を採用する（重複分もレートリミッターの枠内で送る）
+        """
         self.output_file_path = output_file_path
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.first_token_timeout = first_token_timeout
+        self.stall_timeout = stall_timeout
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
         self.total_tokens_processed = 0
         self.total_chunks_processed = 0
+        self.total_requests = 0
+        self.hedged_requests = 0
+        self.chunk_latencies = []
+        self.chunk_stats = []
         self.errors = []
         
-    def create_output_header(self, input_file_path, total_chunks):
-        """出力ファイルのヘッダーを作成"""
+    def create_output_header(self, input_file_path, total_chunks=None):
+        """出力ファイルのヘッダーを作成（total_chunks が None ならストリーミング入力）"""
         with open(self.output_file_path, 'w', encoding='utf-8') as f:
             f.write(f"# 文字起こし文の校正結果\n")
             f.write(f"# 元ファイル: {os.path.basename(input_file_path)}\n")
             f.write(f"# 処理開始: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-            f.write(f"# チャンク数: {total_chunks}\n")
+            f.write(f"# チャンク数: {total_chunks if total_chunks is not None else '未確定（逐次入力）'}\n")
             f.write(f"# モデル: gemini-2.0-flash\n")
             f.write(f"# 処理方式: ストリーミング\n\n")
     
@@ -67,27 +166,20 @@ class StreamingProcessor:
         with open(input_file_path, 'r', encoding='utf-8') as f:
             content = f.read()
         
-        # より賢い分割方法：文単位で分割
-        sentences = []
-        current_sentence = ""
-        
-        for char in content:
-            current_sentence += char
-            if char in ['。', '！', '？', '\n']:
-                sentences.append(current_sentence)
-                current_sentence = ""
-        
-        if current_sentence:
-            sentences.append(current_sentence)
+        return list(self.split_stream_into_chunks([content], chunk_size))
+    
+    def split_stream_into_chunks(self, text_stream, chunk_size=50000):
+        """逐次届くテキストをチャンクに分割し、完成したチャンクから順に返す
         
-        # チャンクにまとめる
-        chunks = []
+        text_stream は文字列のイテラブル（音声認識のセグメント結果など）。
+        全体が揃うのを待たずに、チャンクサイズに達した時点で yield する。
+        """
         current_chunk = []
         current_size = 0
         
-        for sentence in sentences:
+        for sentence in self._split_stream_into_sentences(text_stream):
             if current_size + len(sentence) > chunk_size and current_chunk:
-                chunks.append(''.join(current_chunk))
+                yield ''.join(current_chunk)
                 current_chunk = [sentence]
                 current_size = len(sentence)
             else:
@@ -95,18 +187,34 @@ class StreamingProcessor:
                 current_size += len(sentence)
         
         if current_chunk:
-            chunks.append(''.join(current_chunk))
+            yield ''.join(current_chunk)
+    
+    def _split_stream_into_sentences(self, text_stream):
+        """より賢い分割方法：文単位で分割（テキスト片をまたぐ文にも対応）"""
+        current_sentence = ""
+        
+        for text in text_stream:
+            for char in text:
+                current_sentence += char
+                if char in ['。', '！', '？', '\n']:
+                    yield current_sentence
+                    current_sentence = ""
         
-        return chunks
+        if current_sentence:
+            yield current_sentence
     
     def process_chunk_with_retry(self, chunk_text, chunk_num, total_chunks, max_retries=3):
         """チャンクを再試行機能付きで処理"""
         for attempt in range(max_retries):
+            # 途中で失敗した試行の書きかけを取り消せるよう、書き込み前の位置を覚えておく
+            offset = os.path.getsize(self.output_file_path) if os.path.exists(self.output_file_path) else 0
             try:
                 return self._process_chunk_streaming(chunk_text, chunk_num, total_chunks)
             except Exception as e:
                 if attempt < max_retries - 1:
                     print(f"  エラーが発生しました。{attempt + 1}回目の再試行... ({e})")
+                    with open(self.output_file_path, 'r+b') as f:
+                        f.truncate(offset)
                     time.sleep(2 ** attempt)  # 指数バックオフ
                 else:
                     print(f"  最大再試行回数に達しました。エラーを記録します。")
@@ -121,7 +229,8 @@ class StreamingProcessor:
     def _process_chunk_streaming(self, chunk_text, chunk_num, total_chunks):
         """ストリーミング処理でチャンクを処理"""
         prompt = f"""以下の文字起こし文を自然な日本語に修正してください。
-チャンク {chunk_num}/{total_chunks} の内容です。
+チャンク {chunk_label(chunk_num, total_chunks)} の内容です。
+[セグメント 3 文字起こし失敗] のような角括弧の目印は、修正せずにそのままの位置に残してください。
 
 文字起こし文:
 {chunk_text}
@@ -131,44 +240,63 @@ class StreamingProcessor:
         
         # 出力ファイルにチャンクヘッダーを追加
         with open(self.output_file_path, 'a', encoding='utf-8') as f:
-            f.write(f"\n## チャンク {chunk_num}/{total_chunks}\n")
+            f.write(f"\n## チャンク {chunk_label(chunk_num, total_chunks)}\n")
             f.write(f"処理開始: {datetime.now().strftime('%H:%M:%S')}\n\n")
         
-        # ストリーミングレスポンスを処理（正しいAPI使用方法）
-        response_stream = client.models.generate_content_stream(
-            model="gemini-2.0-flash",
-            contents=[prompt],
-            generation_config={
-                "max_output_tokens": 8192,
-                "temperature": 0.1,
-            }
-        )
-        
-        accumulated_text = ""
         token_count = 0
-        write_count = 0
-        
-        for response in response_stream:
-            if response.candidates and response.candidates[0].content:
-                for part in response.candidates[0].content.parts:
-                    if part.text:
-                        accumulated_text += part.text
-                        token_count += len(part.text.split())
-                        
-                        # 一定量のテキストが蓄積されたらファイルに書き込み
-                        if len(accumulated_text) >= 500:  # 500文字ごとに書き込み
-                            with open(self.output_file_path, 'a', encoding='utf-8') as f:
-                                f.write(accumulated_text)
-                            write_count += 1
-                            print(f"    {write_count}回目の書き込み: {len(accumulated_text)} 文字")
-                            accumulated_text = ""
-        
-        # 残りのテキストを書き込み
-        if accumulated_text:
+        output_chars = 0
+        usage = None
+        
+        # レイテンシはレートリミッターの待ち時間を含めずに測る（ヘッジの閾値に使うため）
+        self.rate_limiter.acquire()
+        self.total_requests += 1
+        start_time = time.monotonic()
+        
+        if self.hedge:
+            # 重複リクエストのどちらが採用されるか分からないので、完了してから書き込む
+            text, usage = self._generate_hedged(prompt, chunk_num, start_time)
+            token_count = len(text.split())
+            output_chars = len(text)
             with open(self.output_file_path, 'a', encoding='utf-8') as f:
-                f.write(accumulated_text)
-            write_count += 1
-            print(f"   最終書き込み: {len(accumulated_text)} 文字")
+                f.write(text)
+            print(f"   書き込み: {len(text)} 文字")
+        else:
+            accumulated_text = ""
+            write_count = 0
+            
+            for response in self._iter_stream_responses(prompt):
+                usage = response_usage(response) or usage
+                text = response_text(response)
+                if text:
+                    output_chars += len(text)
+                    accumulated_text += text
+                    token_count += len(text.split())
+                    
+                    # 一定量のテキストが蓄積されたらファイルに書き込み
+                    if len(accumulated_text) >= 500:  # 500文字ごとに書き込み
+                        with open(self.output_file_path, 'a', encoding='utf-8') as f:
+                            f.write(accumulated_text)
+                        write_count += 1
+                        print(f"    {write_count}回目の書き込み: {len(accumulated_text)} 文字")
+                        accumulated_text = ""
+            
+            # 残りのテキストを書き込み
+            if accumulated_text:
+                with open(self.output_file_path, 'a', encoding='utf-8') as f:
+                    f.write(accumulated_text)
+                write_count += 1
+                print(f"   最終書き込み: {len(accumulated_text)} 文字")
+        
+        latency = time.monotonic() - start_time
+        self.chunk_latencies.append(latency)
+        self.chunk_stats.append({
+            'chunk': chunk_num,
+            'input_chars': len(chunk_text),
+            'output_chars': output_chars,
+            'prompt_tokens': usage[0] if usage else None,
+            'output_tokens': usage[1] if usage else None,
+            'latency_sec': round(latency, 2),
+        })
         
         # チャンク終了マーカーを追加
         with open(self.output_file_path, 'a', encoding='utf-8') as f:
@@ -179,12 +307,131 @@ class StreamingProcessor:
         
         return True
     
+    def _iter_stream_responses(self, prompt, cancel_event=None):
+        """ストリーミングレスポンスを、タイムアウト付きで1つずつ返す
+        
+        最初のレスポンスが first_token_timeout 秒、以降のレスポンスが
+        stall_timeout 秒以内に届かなければ StreamStallError を送出する。
+        cancel_event がセットされたら読み出しをやめる。
+        """
+        responses = queue.Queue()
+        stop_event = threading.Event()
+        
+        def produce():
+            try:
+                # ストリーミングレスポンスを処理（正しいAPI使用方法）
+                response_stream = get_client().models.generate_content_stream(
+                    model="gemini-2.0-flash",
+                    contents=[prompt],
+                    config=types.GenerateContentConfig(
+                        max_output_tokens=MAX_OUTPUT_TOKENS,
+                        temperature=0.1,
+                    )
+                )
+                for response in response_stream:
+                    if stop_event.is_set():
+                        return
+                    responses.put(('response', response))
+                responses.put(('done', None))
+            except Exception as e:
+                responses.put(('error', e))
+        
+        threading.Thread(target=produce, daemon=True).start()
+        
+        received_first = False
+        try:
+            while True:
+                timeout = self.stall_timeout if received_first else self.first_token_timeout
+                try:
+                    kind, value = responses.get(timeout=timeout)
+                except queue.Empty:
+                    if not received_first:
+                        raise StreamStallError(f"最初のトークンが{timeout}秒以内に届きませんでした")
+                    raise StreamStallError(f"ストリームが{timeout}秒以上停止しました")
+                if cancel_event is not None and cancel_event.is_set():
+                    return
+                if kind == 'done':
+                    return
+                if kind == 'error':
+                    raise value
+                received_first = True
+                yield value
+        finally:
+            stop_event.set()
+    
+    def _hedge_threshold(self):
+        """ヘッジを発動する経過時間（秒）。サンプル不足なら None"""
+        if len(self.chunk_latencies) < self.hedge_min_samples:
+            return None
+        latencies = sorted(self.chunk_latencies)
+        index = math.ceil(len(latencies) * self.hedge_percentile / 100) - 1
+        return latencies[max(0, index)]
+    
+    def _generate_hedged(self, prompt, chunk_num, start_time):
+        """必要に応じて重複リクエストを送り、先に完了した結果の (テキスト, 使用量) を返す
+        
+        元のリクエストの枠は呼び出し側で確保済みで、start_time はその送信時刻。
+        """
+        results = queue.Queue()
+        cancel_event = threading.Event()
+        threshold = self._hedge_threshold()
+        
+        def run(label):
+            try:
+                text = ""
+                usage = None
+                for response in self._iter_stream_responses(prompt, cancel_event):
+                    text += response_text(response)
+                    usage = response_usage(response) or usage
+                results.put((label, (text, usage), None))
+            except Exception as e:
+                results.put((label, None, e))
+        
+        threading.Thread(target=run, args=('元のリクエスト',), daemon=True).start()
+        pending = 1
+        hedged = False
+        hedge_at = start_time + threshold if threshold is not None else None
+        
+        while True:
+            if hedged or hedge_at is None:
+                timeout = None
+            else:
+                timeout = max(0.0, hedge_at - time.monotonic())
+            try:
+                label, result, error = results.get(timeout=timeout)
+            except queue.Empty:
+                # p95 を超えたので、レートリミッターに空きがあれば重複リクエストを送る
+                if self.rate_limiter.try_acquire():
+                    print(f"  チャンク {chunk_num} が {threshold:.1f} 秒を超えたため重複リクエストを送信します")
+                    threading.Thread(target=run, args=('重複リクエスト',), daemon=True).start()
+                    self.total_requests += 1
+                    self.hedged_requests += 1
+                    pending += 1
+                    hedged = True
+                else:
+                    hedge_at = time.monotonic() + self.rate_limiter.wait_time()
+                continue
+            
+            pending -= 1
+            if error is None:
+                cancel_event.set()
+                if hedged:
+                    print(f"  {label}の結果を採用しました")
+                return result
+            if pending == 0:
+                raise error
+            print(f"  {label}が失敗しました。もう一方の完了を待ちます ({error})")
+    
     def save_processing_log(self):
         """処理ログを保存"""
         log_data = {
             'processing_summary': {
                 'total_chunks_processed': self.total_chunks_processed,
                 'total_tokens_processed': self.total_tokens_processed,
+                'total_requests': self.total_requests,
+                'hedged_requests': self.hedged_requests,
+                'chunk_latencies': [round(latency, 2) for latency in self.chunk_latencies],
+                'chunks': self.chunk_stats,
                 'errors': self.errors,
                 'completion_time': datetime.now().isoformat()
             }
@@ -196,12 +443,172 @@ class StreamingProcessor:
         
         print(f"処理ログを保存しました: {log_file}")
 
+def process_chunks(processor, chunks, total_chunks=None):
+    """チャンクを順に校正する
+    
+    chunks はリストでもジェネレータでもよい。ジェネレータの場合は
+    前段（音声認識など）と並行して、届いたチャンクから処理していく。
+    処理したチャンク数を返す。
+    """
+    processed = 0
+    for i, chunk in enumerate(chunks, 1):
+        # API制限はリクエストごとに processor.rate_limiter で守る
+        print(f"\n--- チャンク {chunk_label(i, total_chunks)} 処理中 ---")
+        print(f"チャンクサイズ: {len(chunk)} 文字")
+        
+        success = processor.process_chunk_with_retry(chunk, i, total_chunks)
+        
+        if success:
+            print(f"✓ チャンク {i} 完了")
+        else:
+            print(f"✗ チャンク {i} 失敗")
+        processed = i
+    
+    return processed
+
+def load_usage_history(log_dir):
+    """過去の処理ログ（*_log.json）から見積もり係数を求める
+    
+    実際のトークン使用量が記録されているチャンクだけを使う。出力の比率は
+    出力上限で打ち切られたチャンクを除いて求める。
+    ログがなければ DEFAULT_* の係数を返す。
+    """
+    input_chars = prompt_tokens = output_tokens = 0
+    uncapped_prompt_tokens = uncapped_output_tokens = 0
+    latency = 0.0
+    chunks = requests = 0
+    runs = 0
+    
+    for log_file in glob.glob(os.path.join(log_dir, '*_log.json')):
+        try:
+            with open(log_file, 'r', encoding='utf-8') as f:
+                summary = json.load(f)['processing_summary']
+        except (OSError, ValueError, KeyError) as e:
+            print(f"ログを読み込めませんでした: {log_file} ({e})")
+            continue
+        
+        stats = [c for c in summary.get('chunks', []) if c.get('prompt_tokens')]
+        if not stats:
+            continue
+        runs += 1
+        for c in stats:
+            input_chars += c['input_chars']
+            prompt_tokens += c['prompt_tokens']
+            output_tokens += c['output_tokens']
+            latency += c['latency_sec']
+            if c['output_tokens'] < MAX_OUTPUT_TOKENS:
+                uncapped_prompt_tokens += c['prompt_tokens']
+                uncapped_output_tokens += c['output_tokens']
+        if summary.get('total_chunks_processed'):
+            chunks += summary['total_chunks_processed']
+            requests += summary.get('total_requests', summary['total_chunks_processed'])
+    
+    if not input_chars or not output_tokens:
+        return {
+            'runs': 0,
+            'input_tokens_per_char': DEFAULT_INPUT_TOKENS_PER_CHAR,
+            'output_tokens_per_input_token': DEFAULT_OUTPUT_TOKENS_PER_INPUT_TOKEN,
+            'seconds_per_output_token': DEFAULT_SECONDS_PER_OUTPUT_TOKEN,
+            'requests_per_chunk': DEFAULT_REQUESTS_PER_CHUNK,
+        }
+    
+    return {
+        'runs': runs,
+        'input_tokens_per_char': prompt_tokens / input_chars,
+        'output_tokens_per_input_token': (uncapped_output_tokens / uncapped_prompt_tokens
+                                          if uncapped_prompt_tokens
+                                          else DEFAULT_OUTPUT_TOKENS_PER_INPUT_TOKEN),
+        'seconds_per_output_token': latency / output_tokens,
+        'requests_per_chunk': requests / chunks if chunks else DEFAULT_REQUESTS_PER_CHUNK,
+    }
+
+def plan_batch(input_file_paths, chunk_size, requests_per_minute, log_dir):
+    """APIを呼ばずに、実際のチャンク分割で必要なリクエスト数・時間・費用を見積もる
+    
+    チャンクは逐次処理されるので、1チャンクの所要時間は推定レイテンシと
+    レートリミッターの間隔（重複・再試行分を含む）の大きい方とする。
+    """
+    calibration = load_usage_history(log_dir)
+    interval = 60.0 / requests_per_minute
+    splitter = StreamingProcessor(os.devnull)
+    
+    files = []
+    for input_file_path in input_file_paths:
+        texts = splitter.split_file_into_chunks(input_file_path, chunk_size)
+        chunks = []
+        for chunk in texts:
+            input_tokens = len(chunk) * calibration['input_tokens_per_char']
+            output_tokens = min(input_tokens * calibration['output_tokens_per_input_token'],
+                                MAX_OUTPUT_TOKENS)
+            latency = output_tokens * calibration['seconds_per_output_token']
+            chunks.append({
+                'input_chars': len(chunk),
+                'input_tokens': input_tokens,
+                'output_tokens': output_tokens,
+                'seconds': max(latency, interval * calibration['requests_per_chunk']),
+                'truncated': input_tokens * calibration['output_tokens_per_input_token'] > MAX_OUTPUT_TOKENS,
+            })
+        files.append({'path': input_file_path, 'chunks': chunks, 'texts': texts})
+    
+    all_chunks = [c for f in files for c in f['chunks']]
+    requests_per_chunk = calibration['requests_per_chunk']
+    # 重複リクエスト・再試行の分も入力・出力トークンを消費するものとして計上
+    input_tokens = sum(c['input_tokens'] for c in all_chunks) * requests_per_chunk
+    output_tokens = sum(c['output_tokens'] for c in all_chunks) * requests_per_chunk
+    
+    return {
+        'files': files,
+        'calibration': calibration,
+        'total_chunks': len(all_chunks),
+        'total_requests': math.ceil(len(all_chunks) * requests_per_chunk),
+        'input_tokens': input_tokens,
+        'output_tokens': output_tokens,
+        'seconds': sum(c['seconds'] for c in all_chunks),
+        'cost_usd': (input_tokens * INPUT_PRICE_PER_MILLION_TOKENS
+                     + output_tokens * OUTPUT_PRICE_PER_MILLION_TOKENS) / 1_000_000,
+    }
+
+def print_plan(plan):
+    """見積もり結果を表示"""
+    calibration = plan['calibration']
+    print(f"=== 見積もり ===")
+    if calibration['runs']:
+        print(f"過去 {calibration['runs']} 回分の処理ログで補正済み")
+    else:
+        print(f"過去の処理ログがないため既定の係数で見積もっています")
+    print(f"  入力トークン/文字: {calibration['input_tokens_per_char']:.2f}")
+    print(f"  出力トークン/入力トークン: {calibration['output_tokens_per_input_token']:.2f}")
+    print(f"  秒/出力トークン: {calibration['seconds_per_output_token']:.4f}")
+    print(f"  リクエスト/チャンク: {calibration['requests_per_chunk']:.2f}")
+    
+    for f in plan['files']:
+        print(f"\n入力ファイル: {f['path']}")
+        for i, c in enumerate(f['chunks'], 1):
+            note = " ※出力上限に達する可能性あり" if c['truncated'] else ""
+            print(f"  チャンク {i}: {c['input_chars']} 文字, "
+                  f"入力 {c['input_tokens']:.0f} / 出力 {c['output_tokens']:.0f} トークン, "
+                  f"約 {c['seconds']:.0f} 秒{note}")
+    
+    print(f"\nチャンク数: {plan['total_chunks']}")
+    print(f"リクエスト数: {plan['total_requests']}")
+    print(f"入力トークン数: {plan['input_tokens']:.0f}")
+    print(f"出力トークン数: {plan['output_tokens']:.0f}")
+    print(f"推定処理時間: {plan['seconds'] / 60:.1f} 分")
+    print(f"推定費用: ${plan['cost_usd']:.4f}")
+
 def main():
     """メイン処理"""
+    parser = argparse.ArgumentParser(description="文字起こし文をチャンクに分けて校正します。")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="APIを呼び出さずに、リクエスト数・処理時間・費用の見積もりだけを表示する")
+    args = parser.parse_args()
+    
     # 設定
     input_file_path = "data/input/LLM2024_day2_s2t.txt"
     output_file_path = "data/output/processed_text_advanced_streaming.txt"
     chunk_size = 50000  # チャンクサイズ（文字数）
+    requests_per_minute = 20  # API呼び出しの上限（重複リクエストも含む）
+    hedge = False  # 遅いチャンクに重複リクエストを送るか（README参照）
     
     # 入力ファイルの存在確認
     if not os.path.exists(input_file_path):
@@ -215,16 +622,27 @@ def main():
     file_size = os.path.getsize(input_file_path)
     print(f"=== ファイル情報 ===")
     print(f"入力ファイル: {input_file_path}")
-    print(f"ファイルサイズ: {file_size / 1024:.2f} KB")
-    print(f"推定トークン数: {file_size / 4:.0f}")
+    print(f"ファイルサイズ: {file_size / 1024:.2f} KB\n")
+    
+    # 実際のチャンク分割と過去のログから見積もり
+    plan = plan_batch([input_file_path], chunk_size, requests_per_minute,
+                      os.path.dirname(output_file_path))
+    print_plan(plan)
+    
+    if args.dry_run:
+        print(f"\n--dry-run のためAPIは呼び出さずに終了します。")
+        return
+    
+    # APIキーの確認（未設定ならここで分かりやすいエラーにする）
+    get_client()
     
     # ストリーミングプロセッサーを初期化
-    processor = StreamingProcessor(output_file_path)
+    processor = StreamingProcessor(output_file_path,
+                                   rate_limiter=RateLimiter(requests_per_minute),
+                                   hedge=hedge)
     
-    # ファイルをチャンクに分割
-    print(f"\n=== ファイル分割 ===")
-    chunks = processor.split_file_into_chunks(input_file_path, chunk_size)
-    print(f"チャンク数: {len(chunks)}")
+    # 見積もりで分割したチャンクをそのまま使う
+    chunks = plan['files'][0]['texts']
     
     # 出力ファイルのヘッダーを作成
     processor.create_output_header(input_file_path, len(chunks))
@@ -234,21 +652,7 @@ def main():
     start_time = time.time()
     
     try:
-        for i, chunk in enumerate(chunks, 1):
-            print(f"\n--- チャンク {i}/{len(chunks)} 処理中 ---")
-            print(f"チャンクサイズ: {len(chunk)} 文字")
-            
-            success = processor.process_chunk_with_retry(chunk, i, len(chunks))
-            
-            if success:
-                print(f"✓ チャンク {i} 完了")
-            else:
-                print(f"✗ チャンク {i} 失敗")
-            
-            # API制限を避けるための待機
-            if i < len(chunks):
-                print("次のチャンク処理まで3秒待機...")
-                time.sleep(3)
+        process_chunks(processor, chunks, len(chunks))
         
         # 処理完了
         end_time = time.time()
@@ -258,6 +662,7 @@ def main():
         print(f"処理時間: {processing_time:.2f} 秒")
         print(f"処理済みチャンク: {processor.total_chunks_processed}/{len(chunks)}")
         print(f"総処理トークン数: {processor.total_tokens_processed}")
+        print(f"重複リクエスト数: {processor.hedged_requests}")
         print(f"エラー数: {len(processor.errors)}")
         print(f"出力ファイル: {output_file_path}")
         
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+proofreading_advanced_streaming.py の動作確認
+APIは使わず、偽の client で確認する
+"""
+
+import itertools
+import json
+import sys
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import proofreading_advanced_streaming as pas
+
+
+def fake_response(text, usage=None):
+    """generate_content_stream が返すレスポンスの最小限の偽物"""
+    part = SimpleNamespace(text=text)
+    return SimpleNamespace(
+        usage_metadata=usage,
+        candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]))],
+    )
+
+
+class FakeModels:
+    """呼び出し番号ごとに応答の中身と遅延を変えられる偽の client.models
+
+    script(n) は n 回目の呼び出しに対して [(遅延秒, テキスト), ...] を返す。
+    """
+
+    def __init__(self, script):
+        self.script = script
+        self.calls = itertools.count()
+
+    def generate_content_stream(self, model, contents, config=None):
+        for delay, text in self.script(next(self.calls)):
+            time.sleep(delay)
+            yield fake_response(text)
+
+
+@pytest.fixture
+def fake_client(monkeypatch):
+    def install(script):
+        models = FakeModels(script)
+        monkeypatch.setattr(pas, "client", SimpleNamespace(models=models))
+        return models
+    return install
+
+
+@pytest.fixture
+def processor(tmp_path):
+    def create(**kwargs):
+        p = pas.StreamingProcessor(str(tmp_path / "out.txt"),
+                                   rate_limiter=pas.RateLimiter(6000), **kwargs)
+        p.create_output_header("input.txt", None)
+        return p
+    return create
+
+
+def test_stall_retry_does_not_duplicate_output(fake_client, processor):
+    # 1回目は600文字書いたところで止まり、2回目は最後まで返す
+    def script(n):
+        if n == 0:
+            return [(0, "A" * 300), (0, "A" * 300), (2, "A" * 300)]
+        return [(0, "A" * 300)] * 4
+    fake_client(script)
+    p = processor(stall_timeout=0.5)
+
+    assert p.process_chunk_with_retry("入力", 1, 1) is True
+
+    with open(p.output_file_path, encoding='utf-8') as f:
+        output = f.read()
+    assert output.count("A") == 1200
+    assert output.count("## チャンク 1") == 1
+
+
+def test_first_token_timeout_records_error(fake_client, processor):
+    fake_client(lambda n: [(0.3, "遅い")])
+    p = processor(first_token_timeout=0.05)
+
+    assert p.process_chunk_with_retry("入力", 1, 1, max_retries=1) is False
+    assert len(p.errors) == 1
+    assert "最初のトークン" in p.errors[0]['error']
+
+
+def test_hedge_sends_duplicate_for_slow_chunk(fake_client, processor):
+    # 4回目の呼び出し（4チャンク目の元のリクエスト）だけが遅い
+    def script(n):
+        if n == 3:
+            return [(0, "遅"), (1.0, "い")]
+        return [(0.01, f"結果{n}")]
+    models = fake_client(script)
+    p = processor(hedge=True)
+
+    for i in range(1, 5):
+        assert p.process_chunk_with_retry("入力", i, 4) is True
+
+    assert p.hedged_requests == 1
+    assert p.total_requests == 5
+    with open(p.output_file_path, encoding='utf-8') as f:
+        output = f.read()
+    assert "結果4" in output
+    assert "遅い" not in output
+    assert next(models.calls) == 5
+
+
+def write_log(path, chunks, total_requests):
+    summary = {
+        'total_chunks_processed': len(chunks),
+        'total_requests': total_requests,
+        'chunks': chunks,
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'processing_summary': summary}, f)
+
+
+def test_load_usage_history_calibrates_from_logs(tmp_path):
+    write_log(tmp_path / "run_log.json", [
+        {'input_chars': 1000, 'prompt_tokens': 800, 'output_tokens': 400, 'latency_sec': 4.0},
+        {'input_chars': 1000, 'prompt_tokens': 800, 'output_tokens': pas.MAX_OUTPUT_TOKENS,
+         'latency_sec': 80.0},
+        {'input_chars': 500, 'prompt_tokens': None, 'output_tokens': None, 'latency_sec': 1.0},
+    ], total_requests=4)
+
+    calibration = pas.load_usage_history(str(tmp_path))
+
+    assert calibration['runs'] == 1
+    assert calibration['input_tokens_per_char'] == pytest.approx(0.8)
+    # 出力上限で打ち切られたチャンクは出力比率の計算から除く
+    assert calibration['output_tokens_per_input_token'] == pytest.approx(0.5)
+    assert calibration['requests_per_chunk'] == pytest.approx(4 / 3)
+
+
+def test_load_usage_history_defaults_without_logs(tmp_path):
+    calibration = pas.load_usage_history(str(tmp_path))
+    assert calibration['runs'] == 0
+    assert calibration['input_tokens_per_char'] == pas.DEFAULT_INPUT_TOKENS_PER_CHAR
+
+
+def test_plan_batch_uses_real_chunker(tmp_path):
+    input_path = tmp_path / "input.txt"
+    input_path.write_text("あいうえお。" * 100, encoding='utf-8')
+
+    plan = pas.plan_batch([str(input_path)], chunk_size=120, requests_per_minute=60,
+                          log_dir=str(tmp_path))
+
+    assert plan['total_chunks'] == 5
+    assert plan['files'][0]['texts'] == ["あいうえお。" * 20] * 5
+    # 1リクエストあたり1秒の間隔が最低限かかる
+    assert plan['seconds'] >= 5
+
+
+@pytest.fixture
+def main_without_api_key(tmp_path, monkeypatch):
+    """APIキーなしで main() を実行する準備（クライアントを作ろうとしたら失敗させる）"""
+    input_dir = tmp_path / "data" / "input"
+    input_dir.mkdir(parents=True)
+    (input_dir / "LLM2024_day2_s2t.txt").write_text("あいうえお。" * 100, encoding='utf-8')
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(pas, "GEMINI_API_KEY", None)
+    monkeypatch.setattr(pas, "client", None)
+
+    def forbidden_client(**kwargs):
+        raise AssertionError("APIクライアントが作成されました")
+    monkeypatch.setattr(pas.genai, "Client", forbidden_client)
+
+    def run(*args):
+        monkeypatch.setattr(sys, "argv", ["proofreading_advanced_streaming.py", *args])
+        pas.main()
+    return run
+
+
+def test_main_dry_run_makes_no_api_call(main_without_api_key, tmp_path, capsys):
+    main_without_api_key("--dry-run")
+
+    assert pas.client is None
+    out = capsys.readouterr().out
+    assert "チャンク数: 1" in out
+    assert "--dry-run のためAPIは呼び出さずに終了します" in out
+    assert not (tmp_path / "data" / "output" / "processed_text_advanced_streaming.txt").exists()
+
+
+def test_main_without_api_key_reports_missing_key(main_without_api_key):
+    with pytest.raises(ValueError, match="GEMINI_API_KEY"):
+        main_without_api_key()
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+transcription_streaming.py の動作確認
+APIとffmpegは使わず、StubRecognizer と偽の client で確認する
+"""
+
+from types import SimpleNamespace
+
+import proofreading_advanced_streaming as pas
+import transcription_streaming as ts
+
+
+def fake_response(text, usage=None):
+    """generate_content_stream が返すレスポンスの最小限の偽物"""
+    part = SimpleNamespace(text=text)
+    return SimpleNamespace(
+        usage_metadata=usage,
+        candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]))],
+    )
+
+
+def test_plan_segments_cuts_in_silences():
+    segments = ts.plan_segments(1000, [(100, 101), (290, 292), (550, 551), (900, 901)])
+    assert [(s.start, s.end) for s in segments] == [
+        (0.0, 291.0), (291.0, 550.5), (550.5, 850.5), (850.5, 1000)]
+
+
+def test_plan_segments_hard_cuts_without_silence():
+    segments = ts.plan_segments(700, [], max_segment_sec=300)
+    assert [(s.start, s.end) for s in segments] == [(0.0, 300.0), (300.0, 600.0), (600.0, 700)]
+
+
+def test_split_stream_keeps_sentences_split_across_segments():
+    p = pas.StreamingProcessor("unused.txt")
+    chunks = list(p.split_stream_into_chunks(["今日は", "晴れです。明日", "は雨です。"], chunk_size=8))
+    assert chunks == ["今日は晴れです。", "明日は雨です。"]
+
+
+def test_transcribe_segments_yields_in_order():
+    segments = [ts.Segment(i, i * 10, i * 10 + 10) for i in range(5)]
+    recognizer = ts.StubRecognizer(texts=[f"文{i}。" for i in range(5)], delay=0.01)
+    texts = list(ts.transcribe_segments("media.mp4", segments, recognizer, max_workers=3))
+    assert texts == [f"文{i}。\n" for i in range(5)]
+
+
+def test_transcribe_segments_records_failed_segment_and_continues():
+    class FailingRecognizer(ts.StubRecognizer):
+        def transcribe(self, media_path, segment):
+            if segment.index == 1:
+                raise RuntimeError("認識失敗")
+            return super().transcribe(media_path, segment)
+
+    segments = [ts.Segment(i, i, i + 1) for i in range(3)]
+    errors = []
+    texts = list(ts.transcribe_segments("media.mp4", segments,
+                                        FailingRecognizer(texts=["a", "b", "c"]),
+                                        max_retries=1, errors=errors))
+    assert texts == ["a\n", "[セグメント 2 文字起こし失敗]\n", "c\n"]
+    assert [e['segment'] for e in errors] == [2]
+
+
+def test_failure_marker_is_kept_verbatim_in_prompt(monkeypatch, tmp_path):
+    prompts = []
+
+    class RecordingModels:
+        def generate_content_stream(self, model, contents, config=None):
+            prompts.extend(contents)
+            yield fake_response("校正済み")
+
+    monkeypatch.setattr(pas, "client", SimpleNamespace(models=RecordingModels()))
+    p = pas.StreamingProcessor(str(tmp_path / "out.txt"), rate_limiter=pas.RateLimiter(6000))
+    p.create_output_header("media.mp4")
+
+    assert p.process_chunk_with_retry("前。\n[セグメント 2 文字起こし失敗]\n後。\n", 1, None) is True
+    assert "[セグメント 2 文字起こし失敗]" in prompts[0]
+    assert "そのままの位置に残して" in prompts[0]
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+"""
+このコードは動画から文字起こしをするコードです。
+音声・動画ファイル入力版 - 無音区間で分割したセグメントを並列に文字起こしし、
+順番どおりに校正パイプライン（proofreading_advanced_streaming.py）へ流し込む
+
+文字起こしと校正は並行して進む：チャンクサイズを小さめ（約15分の音声に相当）に
+しているので、先頭の数セグメントが揃った時点で最初のチャンクの校正が始まり、
+その間も残りのセグメントの文字起こしがバックグラウンドで続く。
+
+前提: ffmpeg / ffprobe にPATHが通っていること
+"""
+
+import subprocess
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+# 依存パッケージの自動インストールと .env の読み込みは校正パイプライン側で行われる
+from proofreading_advanced_streaming import RateLimiter, StreamingProcessor, get_client, process_chunks
+
+from google.genai import types
+
+class Segment:
+    """メディアファイル内の1区間（秒単位）"""
+
+    def __init__(self, index, start, end):
+        self.index = index
+        self.start = start
+        self.end = end
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+    def __repr__(self):
+        return f"Segment({self.index}, {self.start:.2f}-{self.end:.2f})"
+
+def get_media_duration(media_path):
+    """ffprobeでメディアの長さ（秒）を取得"""
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-show_entries", "format=duration",
+         "-of", "default=noprint_wrappers=1:nokey=1", media_path],
+        capture_output=True, text=True, check=True
+    )
+    return float(result.stdout.strip())
+
+def detect_silences(media_path, noise_db=-30, min_silence_sec=0.5):
+    """ffmpegのsilencedetectで無音区間 [(開始, 終了), ...] を検出"""
+    result = subprocess.run(
+        ["ffmpeg", "-hide_banner", "-nostats", "-i", media_path,
+         "-af", f"silencedetect=noise={noise_db}dB:d={min_silence_sec}",
+         "-f", "null", "-"],
+        capture_output=True, text=True, encoding="utf-8", errors="replace"
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"無音検出に失敗しました: {result.stderr[-500:]}")
+
+    silences = []
+    silence_start = None
+    for line in result.stderr.splitlines():
+        match = re.search(r"silence_start: (-?[\d.]+)", line)
+        if match:
+            silence_start = max(0.0, float(match.group(1)))
+            continue
+        match = re.search(r"silence_end: ([\d.]+)", line)
+        if match and silence_start is not None:
+            silences.append((silence_start, float(match.group(1))))
+            silence_start = None
+
+    return silences
+
+def plan_segments(duration, silences, max_segment_sec=300, min_segment_sec=30):
+    """無音区間の中央で切り、max_segment_sec を超えないセグメントに分割
+
+    セグメントが min_segment_sec に満たないうちは切らない。
+    上限までに無音がなければ上限位置で強制的に切る。
+    """
+    cut_points = sorted((start + end) / 2 for start, end in silences)
+
+    segments = []
+    segment_start = 0.0
+    last_candidate = None
+
+    for point in cut_points + [duration]:
+        while point - segment_start > max_segment_sec:
+            cut = last_candidate if last_candidate is not None else segment_start + max_segment_sec
+            segments.append(Segment(len(segments), segment_start, cut))
+            segment_start = cut
+            last_candidate = None
+        if point - segment_start >= min_segment_sec:
+            last_candidate = point
+
+    if duration > segment_start:
+        segments.append(Segment(len(segments), segment_start, duration))
+
+    return segments
+
+def extract_segment_audio(media_path, segment, sample_rate=16000):
+    """セグメントを16kHzモノラルのWAVバイト列として切り出す"""
+    result = subprocess.run(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error",
+         "-ss", f"{segment.start:.3f}", "-t", f"{segment.duration:.3f}",
+         "-i", media_path, "-vn", "-ac", "1", "-ar", str(sample_rate),
+         "-f", "wav", "pipe:1"],
+        capture_output=True, check=True
+    )
+    return result.stdout
+
+class GeminiRecognizer:
+    """Gemini APIで音声セグメントを文字起こしする認識器
+
+    rate_limiter を校正側の StreamingProcessor と共有すると、
+    同じAPIキーでの呼び出し全体が1つの上限に収まる。
+    """
+
+    def __init__(self, model="gemini-2.0-flash", rate_limiter=None):
+        self.model = model
+        self.rate_limiter = rate_limiter or RateLimiter()
+
+    def transcribe(self, media_path, segment):
+        """セグメントを文字起こししてテキストを返す"""
+        audio = extract_segment_audio(media_path, segment)
+        self.rate_limiter.acquire()
+        response = get_client().models.generate_content(
+            model=self.model,
+            contents=[
+                "この音声を日本語で一字一句そのまま文字起こししてください。"
+                "要約や補足は加えず、書き起こし文のみを出力してください。",
+                types.Part.from_bytes(data=audio, mime_type="audio/wav"),
+            ]
+        )
+        return response.text or ""
+
+class StubRecognizer:
+    """テスト用のローカル認識器（APIもffmpegも使わない）
+
+    texts を与えればセグメント番号順にその文字列を返し、
+    なければ区間を示すプレースホルダーを返す。
+    delay を指定すると認識にかかる時間を模擬できる。
+    """
+
+    def __init__(self, texts=None, delay=0.0):
+        self.texts = texts
+        self.delay = delay
+
+    def transcribe(self, media_path, segment):
+        if self.delay:
+            time.sleep(self.delay)
+        if self.texts is not None:
+            return self.texts[segment.index]
+        return f"[{segment.start:.1f}秒〜{segment.end:.1f}秒の音声]\n"
+
+def transcribe_segments(media_path, segments, recognizer, max_workers=4, max_retries=3, errors=None):
+    """セグメントを並列に文字起こしし、元の順番どおりにテキストを yield する
+
+    全セグメントを最初にスレッドプールへ投入するので、呼び出し側が
+    前のテキストを処理している間も後続セグメントの認識は進む。
+    再試行しても失敗したセグメントは errors に記録し、代わりに
+    失敗を示す目印を yield して残りのセグメントの処理を続ける。
+    目印は校正のプロンプトでそのまま残すよう指示しているので、出力にも現れる。
+    """
+    def transcribe_with_retry(segment):
+        for attempt in range(max_retries):
+            try:
+                return recognizer.transcribe(media_path, segment)
+            except Exception as e:
+                if attempt < max_retries - 1:
+                    print(f"  セグメント {segment.index + 1} でエラー。{attempt + 1}回目の再試行... ({e})")
+                    time.sleep(2 ** attempt)  # 指数バックオフ
+                else:
+                    raise
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = [executor.submit(transcribe_with_retry, segment) for segment in segments]
+        for segment, future in zip(segments, futures):
+            try:
+                text = future.result()
+            except Exception as e:
+                print(f"  セグメント {segment.index + 1}/{len(segments)} 文字起こし失敗 ({e})")
+                if errors is not None:
+                    errors.append({
+                        'segment': segment.index + 1,
+                        'error': str(e),
+                        'timestamp': datetime.now().isoformat()
+                    })
+                yield f"[セグメント {segment.index + 1} 文字起こし失敗]\n"
+                continue
+            print(f"  セグメント {segment.index + 1}/{len(segments)} 文字起こし完了 "
+                  f"({segment.start:.0f}秒〜{segment.end:.0f}秒, {len(text)} 文字)")
+            # セグメント境界で文が途切れないよう改行で区切る
+            if text and not text.endswith('\n'):
+                text += '\n'
+            yield text
+    finally:
+        # 途中で中断された場合は未着手のセグメントを取り消す
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def tee_to_file(text_stream, file_path):
+    """テキストを流しながら、文字起こし結果をファイルにも保存"""
+    with open(file_path, 'w', encoding='utf-8') as f:
+        for text in text_stream:
+            f.write(text)
+            f.flush()
+            yield text
+
+def main():
+    """メイン処理"""
+    # 設定
+    input_media_path = "data/input/LLM2024_day2.mp4"
+    transcript_file_path = "data/output/LLM2024_day2_s2t.txt"
+    output_file_path = "data/output/processed_text_from_media.txt"
+    # チャンクサイズ（文字数）。講演は1分あたり300〜400文字程度なので、
+    # 5000文字で約15分分。大きくすると全セグメントの文字起こしが終わるまで校正が始まらない
+    chunk_size = 5000
+    requests_per_minute = 20  # 文字起こしと校正を合わせたAPI呼び出しの上限（重複リクエストも含む）
+    hedge = False  # 遅いチャンクに重複リクエストを送るか（README参照）
+    max_segment_sec = 300  # セグメントの最大長（秒）
+    max_workers = 4  # 並列に文字起こしするセグメント数
+    rate_limiter = RateLimiter(requests_per_minute)  # 文字起こしと校正で共有
+    recognizer = GeminiRecognizer(rate_limiter=rate_limiter)
+
+    # 入力ファイルの存在確認
+    if not os.path.exists(input_media_path):
+        print(f"入力ファイルが見つかりません: {input_media_path}")
+        return
+
+    # 出力ディレクトリの作成
+    os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
+
+    # 無音区間でセグメントに分割
+    print(f"=== 無音検出 ===")
+    duration = get_media_duration(input_media_path)
+    silences = detect_silences(input_media_path)
+    segments = plan_segments(duration, silences, max_segment_sec)
+    print(f"入力ファイル: {input_media_path}")
+    print(f"長さ: {duration / 60:.1f} 分")
+    print(f"無音区間: {len(silences)} 箇所")
+    print(f"セグメント数: {len(segments)}")
+
+    processor = StreamingProcessor(output_file_path,
+                                   rate_limiter=rate_limiter,
+                                   hedge=hedge)
+    processor.create_output_header(input_media_path)
+
+    # 文字起こし → チャンク分割 → 校正 をストリーミングで接続
+    print(f"\n=== 文字起こし・校正処理開始 ===")
+    start_time = time.time()
+
+    # 文字起こしの失敗も校正のエラーと同じく processor.errors に記録して続行する
+    texts = transcribe_segments(input_media_path, segments, recognizer, max_workers,
+                                errors=processor.errors)
+    chunks = processor.split_stream_into_chunks(tee_to_file(texts, transcript_file_path), chunk_size)
+
+    try:
+        total_chunks = process_chunks(processor, chunks)
+
+        processing_time = time.time() - start_time
+
+        print(f"\n=== 処理完了 ===")
+        print(f"処理時間: {processing_time:.2f} 秒")
+        print(f"処理済みチャンク: {processor.total_chunks_processed}/{total_chunks}")
+        print(f"重複リクエスト数: {processor.hedged_requests}")
+        print(f"エラー数: {len(processor.errors)}")
+        print(f"文字起こしファイル: {transcript_file_path}")
+        print(f"出力ファイル: {output_file_path}")
+
+        processor.save_processing_log()
+
+        # エラーがある場合は表示
+        if processor.errors:
+            print(f"\n=== エラー一覧 ===")
+            for error in processor.errors:
+                if 'segment' in error:
+                    print(f"セグメント {error['segment']}（文字起こし）: {error['error']}")
+                else:
+                    print(f"チャンク {error['chunk']}: {error['error']}")
+
+    except KeyboardInterrupt:
+        print(f"\n処理が中断されました。")
+        processor.save_processing_log()
+    except Exception as e:
+        print(f"予期しないエラーが発生しました: {e}")
+        processor.save_processing_log()
+
+if __name__ == "__main__":
+    main()